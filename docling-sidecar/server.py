@@ -5,20 +5,41 @@ FastAPI service that wraps Docling for PDF processing.
 Keeps models loaded in memory for fast per-request processing.
 """
 
+import asyncio
+import concurrent.futures
+import contextlib
+import hashlib
 import io
 import logging
+import multiprocessing
+import os
 import pathlib
+import re
+import sys
+import tempfile
+import threading
+from collections import OrderedDict, defaultdict
 from typing import Any
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+import orjson
+from fastapi import FastAPI, File, Request, Response, UploadFile, HTTPException
 from pydantic import BaseModel
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load Docling models before serving the first request."""
+    await warm_up_workers()
+    yield
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title="Docling Sidecar",
     description="PDF processing service using Docling",
     version="0.1.0",
@@ -33,18 +54,191 @@ def touch_activity():
     except OSError:
         pass
 
-# Lazy-load docling to avoid import time at startup
-_converter = None
+# Chunk size for streaming uploads to disk (avoids buffering the whole PDF)
+UPLOAD_CHUNK_SIZE = 1 << 17  # 128 KiB
+
+# Allowed X-Filename-Suffix values for /convert/raw (keeps temp paths safe)
+RAW_SUFFIX_RE = re.compile(r"\.[A-Za-z0-9]{1,10}")
+
+
+# LRU cache of converted documents keyed by upload content hash, so clients
+# calling both /convert and /convert/json only pay for one conversion.
+# Documents are kept as orjson bytes: compact, exactly sized, and served
+# as-is by /convert/json
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "32"))
+MAX_CACHE_MB = int(os.environ.get("MAX_CACHE_MB", "512"))
+
+_result_cache: OrderedDict[str, tuple[str, bytes, int]] = OrderedDict()
+_result_cache_bytes = 0
+_result_cache_lock = threading.Lock()
+
+def cache_get(key: str) -> tuple[str, bytes] | None:
+    """Return cached (markdown, doc_json) for `key`, marking it recently used."""
+    with _result_cache_lock:
+        entry = _result_cache.get(key)
+        if entry is None:
+            return None
+        _result_cache.move_to_end(key)
+        return entry[0], entry[1]
+
+def cache_put(key: str, markdown: str, doc_json: bytes):
+    """Cache a conversion, evicting least recently used entries over budget."""
+    global _result_cache_bytes
+    size = sys.getsizeof(markdown) + sys.getsizeof(doc_json)
+    max_bytes = MAX_CACHE_MB * 1024 * 1024
+    if RESULT_CACHE_SIZE <= 0 or size > max_bytes:
+        return
+    with _result_cache_lock:
+        if key in _result_cache:
+            _result_cache_bytes -= _result_cache.pop(key)[2]
+        _result_cache[key] = (markdown, doc_json, size)
+        _result_cache_bytes += size
+        while len(_result_cache) > RESULT_CACHE_SIZE or _result_cache_bytes > max_bytes:
+            _, (_, _, evicted) = _result_cache.popitem(last=False)
+            _result_cache_bytes -= evicted
+
+def save_upload(file: UploadFile) -> tuple[str, str]:
+    """Stream an upload to a temp file, returning (path, content hash)."""
+    suffix = os.path.splitext(file.filename)[1] or ".pdf"
+    digest = hashlib.blake2b(digest_size=16)
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        try:
+            while chunk := file.file.read(UPLOAD_CHUNK_SIZE):
+                digest.update(chunk)
+                tmp.write(chunk)
+        except BaseException:
+            # Don't leak partial uploads
+            os.unlink(tmp.name)
+            raise
+        tmp_path = tmp.name
+    return tmp_path, digest.hexdigest()
+
+async def save_raw_upload(request: Request) -> tuple[str, str]:
+    """Stream a raw request body to a temp file, returning (path, content hash)."""
+    suffix = request.headers.get("x-filename-suffix", ".pdf")
+    if not RAW_SUFFIX_RE.fullmatch(suffix):
+        suffix = ".pdf"
+    digest = hashlib.blake2b(digest_size=16)
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        try:
+            async for chunk in request.stream():
+                digest.update(chunk)
+                tmp.write(chunk)
+        except BaseException:
+            # Client disconnected mid-body: drop the partial file
+            os.unlink(tmp.name)
+            raise
+        tmp_path = tmp.name
+    return tmp_path, digest.hexdigest()
+
+async def convert_cached(tmp_path: str, key: str, ocr: bool | None = None) -> tuple[str, bytes]:
+    """Convert a document to (markdown, doc_json), reusing cached results."""
+    key = f"{key}:ocr={DOCLING_DO_OCR if ocr is None else ocr}"
+    cached = cache_get(key)
+    if cached is not None:
+        logger.info(f"Result cache hit for {key}")
+        return cached
+
+    markdown, doc_json = await run_blocking(_convert_in_worker, tmp_path, ocr)
+
+    cache_put(key, markdown, doc_json)
+    return markdown, doc_json
+
+# Docling is loaded by the lifespan hook, before the first request is served.
+# One converter per OCR setting; the non-default one is built lazily.
+_converters: dict[bool, Any] = {}
+_converters_lock = threading.Lock()
+
+DOCLING_DO_OCR = os.environ.get("DOCLING_DO_OCR", "false").lower() == "true"
+DOCLING_DO_TABLES = os.environ.get("DOCLING_DO_TABLES", "true").lower() == "true"
+
+def get_converter(ocr: bool | None = None):
+    """Get or create the document converter for an OCR setting (singleton per setting)."""
+    do_ocr = DOCLING_DO_OCR if ocr is None else ocr
+    converter = _converters.get(do_ocr)
+    if converter is not None:
+        return converter
+
+    # Pool threads can race on the first request for a setting; build (and
+    # load models) only once
+    with _converters_lock:
+        if do_ocr not in _converters:
+            logger.info(f"Loading Docling converter (ocr={do_ocr})...")
+            from docling.datamodel.base_models import InputFormat
+            from docling.datamodel.pipeline_options import PdfPipelineOptions
+            from docling.document_converter import DocumentConverter, PdfFormatOption
+
+            # OCR is only needed for scanned PDFs and dominates per-page time on
+            # text-native ones, so it is off unless enabled
+            opts = PdfPipelineOptions()
+            opts.do_ocr = do_ocr
+            opts.do_table_structure = DOCLING_DO_TABLES
+            converter = DocumentConverter(
+                format_options={InputFormat.PDF: PdfFormatOption(pipeline_options=opts)}
+            )
+            converter.initialize_pipeline(InputFormat.PDF)
+            _converters[do_ocr] = converter
+            logger.info("Docling converter loaded!")
+    return _converters[do_ocr]
+
+
+def warm_up_converter():
+    """Create the default converter, loading its PDF pipeline models."""
+    get_converter()
+
+
+def _convert_in_worker(tmp_path: str, ocr: bool | None) -> tuple[str, bytes]:
+    """
+    Convert a document on a pool worker (blocking).
+
+    Returns (markdown, doc_json), with the document serialized here so the
+    encoding stays off the event loop.
+    """
+    doc = get_converter(ocr).convert(tmp_path).document
+
+    # Export to markdown, and to dict to reliably access page-level content
+    markdown = doc.export_to_markdown()
+    return markdown, orjson.dumps(doc.export_to_dict())
+
+
+def _worker_ready() -> int:
+    """No-op task used to force pool workers to start (and warm up)."""
+    return os.getpid()
 
-def get_converter():
-    """Get or create the document converter (singleton)."""
-    global _converter
-    if _converter is None:
-        logger.info("Loading Docling converter (first request)...")
-        from docling.document_converter import DocumentConverter
-        _converter = DocumentConverter()
-        logger.info("Docling converter loaded!")
-    return _converter
+
+# Worker pool for the blocking, CPU-heavy Docling calls so they don't stall
+# the event loop (health checks, uploads) while a document converts.
+# DOCLING_PROCS > 0 uses that many pre-warmed worker processes, each with its
+# own converter, so Docling's Python post-processing isn't GIL-serialized
+# across requests (at the cost of one model copy per process). Otherwise a
+# DOCLING_WORKERS thread pool shares the in-process converter.
+DOCLING_PROCS = int(os.environ.get("DOCLING_PROCS", "0"))
+DOCLING_WORKERS = int(os.environ.get("DOCLING_WORKERS", "2"))
+
+if DOCLING_PROCS > 0:
+    _executor = concurrent.futures.ProcessPoolExecutor(
+        max_workers=DOCLING_PROCS,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=warm_up_converter,
+    )
+else:
+    _executor = concurrent.futures.ThreadPoolExecutor(max_workers=DOCLING_WORKERS)
+
+
+async def run_blocking(func, *args):
+    """Run a blocking call on the Docling worker pool."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+async def warm_up_workers():
+    """Load Docling models where conversions will run, before serving."""
+    if DOCLING_PROCS > 0:
+        pids = await asyncio.gather(
+            *(run_blocking(_worker_ready) for _ in range(DOCLING_PROCS))
+        )
+        logger.info(f"Docling worker processes ready: {sorted(set(pids))}")
+    else:
+        await asyncio.to_thread(warm_up_converter)
 
 
 class PageContent(BaseModel):
@@ -61,6 +255,47 @@ class ConversionResult(BaseModel):
     metadata: dict[str, Any]
 
 
+def build_conversion_result(markdown: str, doc_json: bytes) -> ConversionResult:
+    """Pack a converted document into the /convert response (blocking)."""
+    doc_dict = orjson.loads(doc_json)
+
+    # Group text from texts array by page in a single pass
+    pages_dict: defaultdict[int, list[str]] = defaultdict(list)
+    for text_item in doc_dict.get('texts', ()):
+        text = text_item.get('text')
+        if not text:
+            continue
+        prov = text_item.get('prov')
+        page_no = prov[0].get('page_no', 1) if prov else 1
+        pages_dict[page_no].append(text)
+    
+    # Get page count, falling back to the highest page that has text
+    num_pages = len(doc_dict.get('pages', {})) or max(pages_dict, default=1)
+    
+    # Build pages list
+    pages = [
+        PageContent(
+            page_num=i, 
+            text="\n\n".join(pages_dict.get(i, ()))
+        )
+        for i in range(1, num_pages + 1)
+    ]
+    
+    # Calculate stats
+    non_empty_pages = sum(1 for p in pages if p.text)
+    logger.info(f"Conversion complete: {num_pages} pages ({non_empty_pages} with content), {len(markdown)} chars markdown")
+    
+    # Extract metadata
+    metadata = doc_dict.get('origin', {})
+    
+    return ConversionResult(
+        markdown=markdown,
+        pages=pages,
+        total_pages=num_pages,
+        metadata=metadata,
+    )
+
+
 @app.get("/health")
 async def health():
     """Health check endpoint."""
@@ -68,10 +303,12 @@ async def health():
 
 
 @app.post("/convert", response_model=ConversionResult)
-async def convert_document(file: UploadFile = File(...)):
+async def convert_document(file: UploadFile = File(...), ocr: bool | None = None):
     """
     Convert a PDF document to structured output.
     
+    Pass `?ocr=true` or `?ocr=false` to override DOCLING_DO_OCR for this request.
+    
     Returns:
     - Full markdown export
     - Page-by-page OCR text
@@ -82,80 +319,17 @@ async def convert_document(file: UploadFile = File(...)):
     if not file.filename:
         raise HTTPException(status_code=400, detail="No filename provided")
 
-    # Read file content
-    content = await file.read()
-    logger.info(f"Received file: {file.filename} ({len(content)} bytes)")
-    
     try:
-        converter = get_converter()
-        
-        # Write to temp file (docling needs file path or URL)
-        import tempfile
-        import os
-        
-        suffix = os.path.splitext(file.filename)[1] or ".pdf"
-        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-            tmp.write(content)
-            tmp_path = tmp.name
+        # Stream upload to temp file (docling needs file path or URL)
+        tmp_path, key = await asyncio.to_thread(save_upload, file)
+        logger.info(f"Received file: {file.filename} ({os.path.getsize(tmp_path)} bytes)")
         
         try:
             # Convert document
             logger.info(f"Converting {file.filename}...")
-            result = converter.convert(tmp_path)
-            doc = result.document
-            
-            # Export to markdown
-            markdown = doc.export_to_markdown()
-            
-            # Export to dict to reliably access page-level content
-            doc_dict = doc.export_to_dict()
-            
-            # Get page count
-            num_pages = len(doc_dict.get('pages', {}))
-            if num_pages == 0:
-                num_pages = 99  # fallback
+            markdown, doc_json = await convert_cached(tmp_path, key, ocr)
             
-            # Initialize pages dict
-            pages_dict: dict[int, list[str]] = {i: [] for i in range(1, num_pages + 1)}
-            
-            # Extract text from texts array, grouped by page
-            texts = doc_dict.get('texts', [])
-            for text_item in texts:
-                text = text_item.get('text', '')
-                if not text:
-                    continue
-                
-                # Get page number from prov
-                prov = text_item.get('prov', [])
-                page_no = 1
-                if prov and len(prov) > 0:
-                    page_no = prov[0].get('page_no', 1)
-                
-                if page_no in pages_dict:
-                    pages_dict[page_no].append(text)
-            
-            # Build pages list
-            pages = [
-                PageContent(
-                    page_num=i, 
-                    text="\n\n".join(pages_dict.get(i, []))
-                )
-                for i in range(1, num_pages + 1)
-            ]
-            
-            # Calculate stats
-            non_empty_pages = sum(1 for p in pages if p.text)
-            logger.info(f"Conversion complete: {num_pages} pages ({non_empty_pages} with content), {len(markdown)} chars markdown")
-            
-            # Extract metadata
-            metadata = doc_dict.get('origin', {})
-            
-            return ConversionResult(
-                markdown=markdown,
-                pages=pages,
-                total_pages=num_pages,
-                metadata=metadata,
-            )
+            return await asyncio.to_thread(build_conversion_result, markdown, doc_json)
             
         finally:
             # Clean up temp file
@@ -167,40 +341,28 @@ async def convert_document(file: UploadFile = File(...)):
 
 
 @app.post("/convert/json")
-async def convert_document_json(file: UploadFile = File(...)):
+async def convert_document_json(file: UploadFile = File(...), ocr: bool | None = None):
     """
     Convert a PDF document to Docling's native JSON format.
     
     Returns the full DoclingDocument as JSON for maximum detail.
+    Accepts the same `?ocr=` override as /convert.
     """
     touch_activity()
 
     if not file.filename:
         raise HTTPException(status_code=400, detail="No filename provided")
 
-    content = await file.read()
-    logger.info(f"Received file for JSON export: {file.filename} ({len(content)} bytes)")
-    
     try:
-        converter = get_converter()
-        
-        import tempfile
-        import os
-        
-        suffix = os.path.splitext(file.filename)[1] or ".pdf"
-        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-            tmp.write(content)
-            tmp_path = tmp.name
+        tmp_path, key = await asyncio.to_thread(save_upload, file)
+        logger.info(f"Received file for JSON export: {file.filename} ({os.path.getsize(tmp_path)} bytes)")
         
         try:
-            result = converter.convert(tmp_path)
-            doc = result.document
-            
             # Export to JSON
-            json_output = doc.export_to_dict()
+            _, json_output = await convert_cached(tmp_path, key, ocr)
             
             logger.info(f"JSON export complete for {file.filename}")
-            return JSONResponse(content=json_output)
+            return Response(content=json_output, media_type="application/json")
             
         finally:
             os.unlink(tmp_path)
@@ -210,6 +372,61 @@ async def convert_document_json(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/convert/raw", response_model=ConversionResult)
+async def convert_document_raw(request: Request, ocr: bool | None = None):
+    """
+    Convert a PDF sent as the raw request body, skipping multipart parsing.
+    
+    Contract: the body MUST be the raw PDF bytes with `Content-Type: application/pdf`.
+    An optional `X-Filename-Suffix` header (default `.pdf`) sets the temp file
+    extension. Returns the same response as /convert.
+    """
+    touch_activity()
+
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type != "application/pdf":
+        raise HTTPException(status_code=415, detail="Content-Type must be application/pdf")
+
+    try:
+        tmp_path, key = await save_raw_upload(request)
+        size = os.path.getsize(tmp_path)
+        logger.info(f"Received raw upload ({size} bytes)")
+        
+        try:
+            if size == 0:
+                raise HTTPException(status_code=400, detail="Empty request body")
+            markdown, doc_json = await convert_cached(tmp_path, key, ocr)
+            return await asyncio.to_thread(build_conversion_result, markdown, doc_json)
+            
+        finally:
+            os.unlink(tmp_path)
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Raw conversion failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# With `gunicorn --preload`, load the models once in the master process so
+# forked workers share the read-only weight pages copy-on-write instead of
+# each holding a private copy. Not used with DOCLING_PROCS (spawned processes).
+if os.environ.get("PRELOAD") == "1" and DOCLING_PROCS == 0:
+    warm_up_converter()
+
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=3001)
+
+    # Each worker process loads its own copy of the Docling models
+    workers = int(os.environ.get("UVICORN_WORKERS", "1"))
+    uvicorn.run(
+        "server:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=3001,
+        loop="uvloop",
+        http="httptools",
+        log_level="info",
+        workers=workers,
+        timeout_keep_alive=30,
+    )
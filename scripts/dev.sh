@@ -35,7 +35,8 @@ echo "Starting Docling sidecar on :3001..."
 uv run --project docling-sidecar uvicorn server:app --app-dir docling-sidecar --host 0.0.0.0 --port 3001 &
 SIDECAR_PID=$!
 
-for _ in {1..30}; do
+# Models load at startup, so the first health check can take a while
+for _ in {1..120}; do
     if curl -fsS "http://127.0.0.1:3001/health" >/dev/null; then
         echo "Docling sidecar is ready."
         break
@@ -6,19 +6,49 @@ Keeps model loaded in memory for fast per-request processing.
 Same API contract as the docling sidecar.
 """
 
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
 import logging
 import os
+import re
+import shutil
 import tempfile
 import time
+from collections import defaultdict
 from typing import Any
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import mlx.core as mx
+import mlx_vlm.utils
+import orjson
+from docling_core.types.doc.document import DocTagsDocument, DoclingDocument
+from fastapi import FastAPI, File, Request, UploadFile, HTTPException
+from fastapi.responses import StreamingResponse
+from mlx_vlm import apply_chat_template, stream_generate
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL import Image
 from pydantic import BaseModel
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Load and warm up the model before serving, and run the VLM batch worker."""
+    global _vlm_queue, _vlm_worker
+    await run_mlx(warm_up_model)
+    # Created here so the queue belongs to the loop that serves requests
+    _vlm_queue = asyncio.Queue()
+    _vlm_worker = asyncio.create_task(vlm_batch_worker(_vlm_queue))
+    _vlm_worker.add_done_callback(_on_vlm_worker_done)
+    yield
+    _vlm_worker.cancel()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title="SmolDocling Sidecar",
     description="PDF processing service using SmolDocling (MLX)",
     version="0.1.0",
@@ -30,13 +60,67 @@ _tokenizer = None
 _model_config = None
 
 MODEL_NAME = "ds4sd/SmolDocling-256M-preview-mlx-bf16"
+PROMPT = "Convert this page to docling."
+
+# Chunk size for streaming uploads to disk (avoids buffering the whole PDF)
+UPLOAD_CHUNK_SIZE = 1 << 17  # 128 KiB
+
+# Allowed X-Filename-Suffix values for /convert/raw (keeps temp paths safe)
+RAW_SUFFIX_RE = re.compile(r"\.[A-Za-z0-9]{1,10}")
+
+# Parallel poppler workers for rasterization. JPEG keeps the poppler -> Python
+# transfer small; the VLM doesn't need lossless page images.
+RENDER_THREADS = min(os.cpu_count() or 4, 8)
+
+# The Idefics3 image processor rescales every page so its longest edge is
+# exactly `size["longest_edge"]` (upscaling smaller pages) before tiling.
+# Pages are capped at that size, which drops only pixels the processor would
+# resize away; SMOL_MAX_DIM overrides it. At 150 dpi a Letter/A4 page is
+# slightly above the default 1456 px target, so no detail is lost.
+SMOL_DPI = int(os.environ.get("SMOL_DPI", "150"))
+SMOL_MAX_DIM = int(os.environ["SMOL_MAX_DIM"]) if os.environ.get("SMOL_MAX_DIM") else None
+
+# Effective cap, resolved from the processor when the model loads
+_max_image_dim: int | None = SMOL_MAX_DIM
+
+# Bound on pages buffered between pipeline stages
+PIPELINE_QUEUE_SIZE = 2
+
+# Micro-batching of VLM jobs across pages and requests: a batch is dispatched
+# once BATCH_MAX jobs are waiting or BATCH_WAIT_MS has elapsed
+BATCH_MAX = int(os.environ.get("BATCH_MAX", "4"))
+BATCH_WAIT_MS = int(os.environ.get("BATCH_WAIT_MS", "10"))
+
+# Pending (image, prompt, future) jobs and the worker draining them; both are
+# created by the lifespan hook
+_vlm_queue: asyncio.Queue | None = None
+_vlm_worker: asyncio.Task | None = None
+
+
+def _init_mlx_thread():
+    """Give mlx_vlm a generation stream owned by the dedicated MLX thread."""
+    # mlx_vlm creates its generation stream at import time on the importing
+    # thread, and newer MLX releases reject using a stream from another thread
+    mlx_vlm.utils.generation_stream = mx.new_stream(mx.default_device())
+
+
+# All MLX work (model load, warm-up, generation) runs on this single thread;
+# asyncio.to_thread gives no thread affinity
+_mlx_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="mlx", initializer=_init_mlx_thread
+)
+
+
+async def run_mlx(func, *args):
+    """Run a blocking MLX call on the dedicated MLX thread."""
+    return await asyncio.get_running_loop().run_in_executor(_mlx_executor, func, *args)
 
 
 def get_model():
     """Get or create the SmolDocling model (singleton)."""
-    global _model, _tokenizer, _model_config
+    global _model, _tokenizer, _model_config, _max_image_dim
     if _model is None:
-        logger.info("Loading SmolDocling model (first request)...")
+        logger.info("Loading SmolDocling model...")
         t0 = time.time()
         from mlx_vlm import load
         from mlx_vlm.utils import get_model_path, load_config
@@ -47,10 +131,29 @@ def get_model():
         model_path = get_model_path(MODEL_NAME)
         _model_config = load_config(model_path)
 
+        # Cap page images at the processor's own resize target
+        if _max_image_dim is None:
+            image_processor = getattr(_tokenizer, "image_processor", None)
+            size = getattr(image_processor, "size", None) or {}
+            _max_image_dim = size.get("longest_edge")
+        logger.info(f"Page images capped at {_max_image_dim or 'native'} px")
+
         logger.info(f"SmolDocling model loaded in {time.time() - t0:.1f}s")
     return _model, _tokenizer, _model_config
 
 
+def warm_up_model():
+    """Load the model and run a 1-token generation to compile MLX kernels."""
+    model, tokenizer, _ = get_model()
+    t0 = time.time()
+    blank = Image.new("RGB", (64, 64), "white")
+    for _ in stream_generate(
+        model, tokenizer, _cached_template(PROMPT), blank, max_tokens=1
+    ):
+        pass
+    logger.info(f"SmolDocling warm-up done in {time.time() - t0:.1f}s")
+
+
 class PageContent(BaseModel):
     """OCR content for a single page."""
     page_num: int
@@ -65,6 +168,346 @@ class ConversionResult(BaseModel):
     metadata: dict[str, Any]
 
 
+async def _get_or_raise(queue: asyncio.Queue, producers: list[asyncio.Task]):
+    """Get the next item from `queue`, re-raising if a producer task fails first."""
+    getter = asyncio.ensure_future(queue.get())
+    try:
+        while not getter.done():
+            for task in producers:
+                if task.done() and not task.cancelled() and task.exception():
+                    raise task.exception()
+            pending = {task for task in producers if not task.done()}
+            await asyncio.wait({getter, *pending}, return_when=asyncio.FIRST_COMPLETED)
+        return getter.result()
+    finally:
+        getter.cancel()
+
+
+def _render_pages(pdf_path: str, first_page: int, last_page: int) -> list[Any]:
+    """Rasterize a page range, capping each page at the VLM input size (blocking)."""
+    images = convert_from_path(
+        pdf_path,
+        dpi=SMOL_DPI,
+        first_page=first_page,
+        last_page=last_page,
+        thread_count=last_page - first_page + 1,
+        fmt="jpeg",
+        jpegopt={"quality": 85},
+    )
+    if _max_image_dim:
+        for image in images:
+            image.thumbnail((_max_image_dim, _max_image_dim), Image.Resampling.LANCZOS)
+    return images
+
+
+async def render_stage(pdf_path: str, num_pages: int, render_q: asyncio.Queue):
+    """
+    Rasterize the PDF into `render_q`.
+
+    Pages are rendered in chunks of RENDER_THREADS, with one poppler worker per
+    page, so rendering is parallel while still overlapping with inference.
+    """
+    for first_page in range(1, num_pages + 1, RENDER_THREADS):
+        last_page = min(first_page + RENDER_THREADS - 1, num_pages)
+        t_chunk = time.time()
+        images = await asyncio.to_thread(_render_pages, pdf_path, first_page, last_page)
+        logger.info(
+            f"Rendered pages {first_page}-{last_page}/{num_pages} "
+            f"in {time.time() - t_chunk:.1f}s"
+        )
+        for page_num, image in enumerate(images, start=first_page):
+            await render_q.put((page_num, image))
+    await render_q.put(None)
+
+
+def _generate_doctags(image: Any, formatted: str) -> str:
+    """Run SmolDocling on a single in-memory page image (blocking)."""
+    model, tokenizer, _ = get_model()
+
+    # Stream-generate doctags for this page (PIL image is passed straight
+    # through, no PNG round trip via disk)
+    parts = []
+    for result in stream_generate(
+        model,
+        tokenizer,
+        formatted,
+        image,
+        max_tokens=8192,
+    ):
+        text = getattr(result, "text", None)
+        parts.append(text if text is not None else str(result))
+    output = "".join(parts)
+
+    # Clean up output
+    return output.removesuffix("<end_of_utterance>").strip()
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_template(prompt: str) -> str:
+    """Format `prompt` with the model's chat template (once per process)."""
+    _, tokenizer, model_config = get_model()
+    return apply_chat_template(tokenizer, model_config, prompt)
+
+
+def _run_vlm_batch(jobs: list[tuple[Any, str]]) -> list[str | Exception]:
+    """
+    Run SmolDocling over a batch of (image, prompt) jobs (blocking).
+
+    mlx_vlm 0.1.x has no batched generate, so pages run back to back on the
+    hot model. Failures are returned per job so one bad page doesn't fail
+    the batch.
+    """
+    results: list[str | Exception] = []
+    for image, prompt in jobs:
+        try:
+            results.append(_generate_doctags(image, _cached_template(prompt)))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+async def vlm_batch_worker(queue: asyncio.Queue):
+    """Drain `queue` in micro-batches and resolve each job's future."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + BATCH_WAIT_MS / 1000
+        while len(batch) < BATCH_MAX:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # Skip jobs whose request has already gone away
+        batch = [job for job in batch if not job[2].done()]
+        if not batch:
+            continue
+
+        logger.info(f"Running VLM batch of {len(batch)} page(s)")
+        try:
+            results = await run_mlx(
+                _run_vlm_batch, [(image, prompt) for image, prompt, _ in batch]
+            )
+        except Exception as e:
+            logger.exception(f"VLM batch failed: {e}")
+            results = [e] * len(batch)
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+def _on_vlm_worker_done(task: asyncio.Task):
+    """Log a dead batch worker and fail the jobs still waiting for it."""
+    if task.cancelled():
+        error = RuntimeError("VLM batch worker stopped")
+    else:
+        error = task.exception() or RuntimeError("VLM batch worker exited")
+        logger.error("VLM batch worker died", exc_info=error)
+    while _vlm_queue is not None and not _vlm_queue.empty():
+        _, _, future = _vlm_queue.get_nowait()
+        if not future.done():
+            future.set_exception(error)
+
+
+async def submit_vlm_job(image: Any, prompt: str = PROMPT) -> asyncio.Future:
+    """Queue a page image for the batch worker and return its doctags future."""
+    if _vlm_worker is None or _vlm_worker.done():
+        raise RuntimeError("VLM batch worker is not running")
+    future = asyncio.get_running_loop().create_future()
+    await _vlm_queue.put((image, prompt, future))
+    return future
+
+
+async def wait_vlm_result(future: asyncio.Future) -> str:
+    """Await a job's doctags, raising instead of hanging if the worker dies."""
+    try:
+        await asyncio.wait({future, _vlm_worker}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        # Let the worker skip this page now that nobody is waiting for it
+        future.cancel()
+        raise
+    if not future.done():
+        raise RuntimeError("VLM batch worker died before finishing the page")
+    return future.result()
+
+
+async def infer_stage(
+    num_pages: int, render_q: asyncio.Queue, assemble_q: asyncio.Queue
+):
+    """Pull rendered pages from `render_q`, submit them to the VLM batch worker."""
+    while (item := await render_q.get()) is not None:
+        page_num, image = item
+        logger.info(f"Queueing page {page_num}/{num_pages} for inference...")
+        future = await submit_vlm_job(image)
+        try:
+            await assemble_q.put((page_num, future, image, time.time()))
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+    await assemble_q.put(None)
+
+
+async def assemble_stage(pdf_path: str, num_pages: int):
+    """
+    Run the render and infer stages for a PDF and yield
+    (page_num, doctags, image) in page order as each page completes.
+    """
+    render_q: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    assemble_q: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    producers = [
+        asyncio.create_task(render_stage(pdf_path, num_pages, render_q)),
+        asyncio.create_task(infer_stage(num_pages, render_q, assemble_q)),
+    ]
+    try:
+        while (item := await _get_or_raise(assemble_q, producers)) is not None:
+            page_num, future, image, t_page = item
+            doctags = await wait_vlm_result(future)
+            logger.info(
+                f"Page {page_num} done in {time.time() - t_page:.1f}s "
+                f"({len(doctags)} chars doctags)"
+            )
+            yield page_num, doctags, image
+    finally:
+        for task in producers:
+            task.cancel()
+        # Drop pages already queued for the VLM; the batch worker skips
+        # cancelled jobs, so a failed or abandoned request stops using it
+        while not assemble_q.empty():
+            if (item := assemble_q.get_nowait()) is not None:
+                item[1].cancel()
+
+
+def build_document(page_doctags: list[str], page_images: list[Any]) -> DoclingDocument:
+    """Build a DoclingDocument from per-page doctags + images."""
+    doctags_doc = DocTagsDocument.from_doctags_and_image_pairs(
+        page_doctags, page_images
+    )
+    return DoclingDocument.load_from_doctags(doctags_doc)
+
+
+def group_page_texts(doc_dict: dict[str, Any], num_pages: int) -> list[PageContent]:
+    """Group a DoclingDocument dict's texts into per-page content."""
+    pages_dict: defaultdict[int, list[str]] = defaultdict(list)
+    for text_item in doc_dict.get("texts", ()):
+        text = text_item.get("text")
+        if not text:
+            continue
+        prov = text_item.get("prov")
+        page_no = prov[0].get("page_no", 1) if prov else 1
+        pages_dict[page_no].append(text)
+
+    return [
+        PageContent(
+            page_num=i,
+            text="\n\n".join(pages_dict.get(i, ())),
+        )
+        for i in range(1, num_pages + 1)
+    ]
+
+
+def assemble_document(
+    page_doctags: list[str], page_images: list[Any], num_pages: int
+) -> tuple[str, list[PageContent]]:
+    """Build the full document and export markdown + per-page text (blocking)."""
+    docling_doc = build_document(page_doctags, page_images)
+
+    # Export full markdown
+    markdown = docling_doc.export_to_markdown()
+
+    # Export to dict for page-level text
+    return markdown, group_page_texts(docling_doc.export_to_dict(), num_pages)
+
+
+def extract_page_text(doctags: str, image: Any) -> str:
+    """Parse a single page's doctags and return its text (blocking)."""
+    page_doc = build_document([doctags], [image])
+    return group_page_texts(page_doc.export_to_dict(), 1)[0].text
+
+
+def export_markdown(page_doctags: list[str], page_images: list[Any]) -> str:
+    """Build the full document and export it to markdown (blocking)."""
+    return build_document(page_doctags, page_images).export_to_markdown()
+
+
+def save_upload(file: UploadFile) -> str:
+    """Stream an upload to a temp file and return its path."""
+    suffix = os.path.splitext(file.filename)[1] or ".pdf"
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        try:
+            shutil.copyfileobj(file.file, tmp, length=UPLOAD_CHUNK_SIZE)
+        except BaseException:
+            # Don't leak partial uploads
+            os.unlink(tmp.name)
+            raise
+        tmp_path = tmp.name
+    logger.info(f"Received file: {file.filename} ({os.path.getsize(tmp_path)} bytes)")
+    return tmp_path
+
+
+async def save_raw_upload(request: Request) -> str:
+    """Stream a raw request body to a temp file and return its path."""
+    suffix = request.headers.get("x-filename-suffix", ".pdf")
+    if not RAW_SUFFIX_RE.fullmatch(suffix):
+        suffix = ".pdf"
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
+        try:
+            async for chunk in request.stream():
+                tmp.write(chunk)
+        except BaseException:
+            # Client disconnected mid-body: drop the partial file
+            os.unlink(tmp.name)
+            raise
+        tmp_path = tmp.name
+    logger.info(f"Received raw upload ({os.path.getsize(tmp_path)} bytes)")
+    return tmp_path
+
+
+async def convert_pdf(pdf_path: str) -> ConversionResult:
+    """Convert a PDF on disk to a ConversionResult via the page pipeline."""
+    t0 = time.time()
+
+    info = await asyncio.to_thread(pdfinfo_from_path, pdf_path)
+    num_pages = int(info["Pages"])
+    logger.info(f"PDF has {num_pages} pages")
+
+    # Rasterize, infer and assemble as concurrent stages so page N+1 is
+    # being rendered while page N is being decoded by the VLM.
+    page_doctags: list[str] = []
+    page_images: list[Any] = []
+    async with contextlib.aclosing(assemble_stage(pdf_path, num_pages)) as stage:
+        async for _, doctags, image in stage:
+            page_doctags.append(doctags)
+            page_images.append(image)
+
+    markdown, pages = await asyncio.to_thread(
+        assemble_document, page_doctags, page_images, num_pages
+    )
+
+    elapsed = time.time() - t0
+    non_empty = sum(1 for p in pages if p.text)
+    logger.info(
+        f"Conversion complete: {num_pages} pages ({non_empty} with content), "
+        f"{len(markdown)} chars markdown, {elapsed:.1f}s total"
+    )
+
+    return ConversionResult(
+        markdown=markdown,
+        pages=pages,
+        total_pages=num_pages,
+        metadata={
+            "model": MODEL_NAME,
+            "processing_time_s": round(elapsed, 2),
+        },
+    )
+
+
 @app.get("/health")
 async def health():
     """Health check endpoint."""
@@ -84,126 +527,129 @@ async def convert_document(file: UploadFile = File(...)):
     if not file.filename:
         raise HTTPException(status_code=400, detail="No filename provided")
 
-    content = await file.read()
-    logger.info(f"Received file: {file.filename} ({len(content)} bytes)")
-
+    tmp_path = None
     try:
-        from pdf2image import convert_from_bytes
-        from mlx_vlm import apply_chat_template, stream_generate
-        from docling_core.types.doc.document import DocTagsDocument, DoclingDocument
+        tmp_path = await asyncio.to_thread(save_upload, file)
+        return await convert_pdf(tmp_path)
 
-        model, tokenizer, model_config = get_model()
+    except Exception as e:
+        logger.exception(f"Conversion failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        t0 = time.time()
+    finally:
+        if tmp_path is not None:
+            os.unlink(tmp_path)
 
-        # Convert PDF pages to images
-        logger.info("Converting PDF pages to images...")
-        images = convert_from_bytes(content, dpi=150)
-        num_pages = len(images)
-        logger.info(f"Got {num_pages} pages in {time.time() - t0:.1f}s")
-
-        # Process each page with SmolDocling
-        prompt = "Convert this page to docling."
-        page_doctags = []
-        page_images = []
-
-        # Create temp dir for page images (mlx_vlm 0.1.x needs file paths)
-        with tempfile.TemporaryDirectory() as tmpdir:
-            for i, image in enumerate(images):
-                page_num = i + 1
-                logger.info(f"Processing page {page_num}/{num_pages}...")
-                t_page = time.time()
-
-                # Save page image to temp file
-                img_path = os.path.join(tmpdir, f"page_{page_num}.png")
-                image.save(img_path, "PNG")
-
-                # Format prompt with chat template
-                formatted = apply_chat_template(
-                    tokenizer, model_config, prompt
-                )
-
-                # Stream-generate doctags for this page
-                output = ""
-                for result in stream_generate(
-                    model,
-                    tokenizer,
-                    formatted,
-                    img_path,
-                    max_tokens=8192,
-                ):
-                    output += result.text if hasattr(result, "text") else str(result)
-
-                # Clean up output
-                if output.endswith("<end_of_utterance>"):
-                    output = output[: -len("<end_of_utterance>")]
-                output = output.strip()
-
-                page_doctags.append(output)
-                page_images.append(image)
-                logger.info(
-                    f"Page {page_num} done in {time.time() - t_page:.1f}s "
-                    f"({len(output)} chars doctags)"
-                )
-
-        # Build DoclingDocument from doctags + images
-        doctags_doc = DocTagsDocument.from_doctags_and_image_pairs(
-            page_doctags, page_images
-        )
-        docling_doc = DoclingDocument.load_from_doctags(doctags_doc)
 
-        # Export full markdown
-        markdown = docling_doc.export_to_markdown()
+@app.post("/convert/raw", response_model=ConversionResult)
+async def convert_document_raw(request: Request):
+    """
+    Convert a PDF sent as the raw request body, skipping multipart parsing.
 
-        # Export to dict for page-level text
-        doc_dict = docling_doc.export_to_dict()
+    Contract: the body MUST be the raw PDF bytes with `Content-Type: application/pdf`.
+    An optional `X-Filename-Suffix` header (default `.pdf`) sets the temp file
+    extension. Returns the same response as /convert.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type != "application/pdf":
+        raise HTTPException(status_code=415, detail="Content-Type must be application/pdf")
 
-        pages_dict: dict[int, list[str]] = {i: [] for i in range(1, num_pages + 1)}
+    tmp_path = await save_raw_upload(request)
 
-        texts = doc_dict.get("texts", [])
-        for text_item in texts:
-            text = text_item.get("text", "")
-            if not text:
-                continue
-            prov = text_item.get("prov", [])
-            page_no = 1
-            if prov and len(prov) > 0:
-                page_no = prov[0].get("page_no", 1)
-            if page_no in pages_dict:
-                pages_dict[page_no].append(text)
-
-        pages = [
-            PageContent(
-                page_num=i,
-                text="\n\n".join(pages_dict.get(i, [])),
-            )
-            for i in range(1, num_pages + 1)
-        ]
+    try:
+        if os.path.getsize(tmp_path) == 0:
+            raise HTTPException(status_code=400, detail="Empty request body")
+        return await convert_pdf(tmp_path)
 
-        elapsed = time.time() - t0
-        non_empty = sum(1 for p in pages if p.text)
-        logger.info(
-            f"Conversion complete: {num_pages} pages ({non_empty} with content), "
-            f"{len(markdown)} chars markdown, {elapsed:.1f}s total"
-        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"Raw conversion failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        return ConversionResult(
-            markdown=markdown,
-            pages=pages,
-            total_pages=num_pages,
-            metadata={
-                "model": MODEL_NAME,
-                "processing_time_s": round(elapsed, 2),
-            },
-        )
+    finally:
+        os.unlink(tmp_path)
 
+
+@app.post("/convert/stream")
+async def convert_document_stream(file: UploadFile = File(...)):
+    """
+    Convert a PDF like /convert, streaming NDJSON records as pages complete.
+
+    Emits one `{"type": "page", "page_num", "text"}` record per page, then a
+    final `{"type": "done", "markdown", "total_pages", "metadata"}` record.
+    Errors after the stream has started are sent as `{"type": "error", "detail"}`.
+    """
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="No filename provided")
+
+    tmp_path = None
+    try:
+        tmp_path = await asyncio.to_thread(save_upload, file)
+        info = await asyncio.to_thread(pdfinfo_from_path, tmp_path)
+        num_pages = int(info["Pages"])
     except Exception as e:
+        if tmp_path is not None:
+            os.unlink(tmp_path)
         logger.exception(f"Conversion failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def records():
+        t0 = time.time()
+        page_doctags: list[str] = []
+        page_images: list[Any] = []
+        try:
+            async with contextlib.aclosing(assemble_stage(tmp_path, num_pages)) as stage:
+                async for page_num, doctags, image in stage:
+                    page_doctags.append(doctags)
+                    page_images.append(image)
+                    # Doctags parsing is CPU-bound; keep it off the event loop
+                    text = await asyncio.to_thread(extract_page_text, doctags, image)
+                    yield orjson.dumps(
+                        {"type": "page", "page_num": page_num, "text": text}
+                    ) + b"\n"
+
+            markdown = await asyncio.to_thread(export_markdown, page_doctags, page_images)
+            elapsed = time.time() - t0
+            logger.info(
+                f"Streamed conversion complete: {num_pages} pages, "
+                f"{len(markdown)} chars markdown, {elapsed:.1f}s total"
+            )
+            yield orjson.dumps(
+                {
+                    "type": "done",
+                    "markdown": markdown,
+                    "total_pages": num_pages,
+                    "metadata": {
+                        "model": MODEL_NAME,
+                        "processing_time_s": round(elapsed, 2),
+                    },
+                }
+            ) + b"\n"
+
+        except Exception as e:
+            logger.exception(f"Streamed conversion failed: {e}")
+            yield orjson.dumps({"type": "error", "detail": str(e)}) + b"\n"
+
+        finally:
+            os.unlink(tmp_path)
+
+    return StreamingResponse(records(), media_type="application/x-ndjson")
+
 
 if __name__ == "__main__":
     import uvicorn
 
     port = int(os.environ.get("PORT", "3005"))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Each worker process loads its own model and runs its own VLM batch worker
+    workers = int(os.environ.get("UVICORN_WORKERS", "1"))
+    uvicorn.run(
+        "server:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        log_level="info",
+        workers=workers,
+        timeout_keep_alive=30,
+    )